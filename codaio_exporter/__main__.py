@@ -1,14 +1,20 @@
 import argparse
 import asyncio
 import logging
+import sys
 from typing import NoReturn
 
-from codaio_exporter.export import export_all_docs, export_doc
+from codaio_exporter.export import export_all_docs, export_doc, ExportOptions
 from codaio_exporter.reimport import reimport_doc
 from codaio_exporter.progress import ProgressDisplay, with_progress_display
 
 
 async def async_main() -> None:
+    if sys.version_info >= (3, 12):
+        # Start running new tasks right away instead of waiting for the next event loop iteration.
+        # We create a lot of tasks and many of them finish (or hit their first real I/O) immediately.
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+
     # Progress display needs to be initialized before the loggers so that stdout/stderr is displayed correctly
     # above the progress bars and doesn't interfere with them
     with with_progress_display() as progress_display:
@@ -22,6 +28,10 @@ async def async_main() -> None:
         parser_export = subparsers.add_parser('export', help="Export tables from one or more coda.io documents")
         parser_export.add_argument('--dest-dir', type=str, help="Destination directory to export to")
         parser_export.add_argument('--src-doc-id', type=str, help="Limit export to the tables in the document with the given id")
+        parser_export.add_argument('--cache-dir', type=str, help="Remember downloaded data in this directory, so that later exports only download data that changed since")
+        parser_export.add_argument('--rows-jsonl', action='store_true', help="Write the raw rows of each table into a single rows.jsonl file instead of one JSON and one YAML file per row")
+        parser_export.add_argument('--compress', action='store_true', help="Write the JSON files gzip compressed (as .json.gz). Reimport can read these directly")
+        parser_export.add_argument('--no-yaml', action='store_true', help="Only write JSON files, without a YAML file next to each of them")
         parser_export.set_defaults(func=main_export)
 
         parser_reimport = subparsers.add_parser('reimport', help="Reimport previously exported tables into a coda.io document")
@@ -40,10 +50,11 @@ async def main_export(args: argparse.Namespace, progress_display: ProgressDispla
     if args.dest_dir is None:
         error_exit("Please specify the --dest-dir parameter")
     
+    options = ExportOptions(rows_jsonl=args.rows_jsonl, compress=args.compress, yaml=not args.no_yaml)
     if args.src_doc_id is None:
-        await export_all_docs(args.api_token, args.dest_dir, progress_display)
+        await export_all_docs(args.api_token, args.dest_dir, progress_display, cache_dir=args.cache_dir, options=options)
     else:
-        await export_doc(args.api_token, args.dest_dir, args.src_doc_id, progress_display)
+        await export_doc(args.api_token, args.dest_dir, args.src_doc_id, progress_display, cache_dir=args.cache_dir, options=options)
 
     print("Export successfully finished")
 
@@ -1,11 +1,11 @@
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
 from codaio_exporter.api.doc import DocAPI
 from codaio_exporter.api.client import Client, make_client
 
 @asynccontextmanager
-async def make_api(api_token: str) -> AsyncGenerator['API', None]:
-    async with make_client(api_token) as client:
+async def make_api(api_token: str, cache_dir: Optional[str] = None, evict_untouched_cache_entries: bool = False) -> AsyncGenerator['API', None]:
+    async with make_client(api_token, cache_dir, evict_untouched_cache_entries) as client:
         yield API(client)
 
 class API:
@@ -17,5 +17,5 @@ class API:
             yield DocAPI(self._client, doc)
 
     async def get_doc(self, doc_id: str) -> DocAPI:
-        doc = await self._client.get_item(f"/docs/{doc_id}")
+        doc = await self._client.get_item(f"/docs/{doc_id}", cache=True)
         return DocAPI(self._client, doc)
@@ -1,18 +1,40 @@
 from typing import final, Final, Dict, Any, AsyncGenerator, NewType, Optional, Callable
 import aiohttp
+import orjson
 import logging
 import asyncio
 from contextlib import asynccontextmanager
 
-from codaio_exporter.api.parse import parse_dict_str_any, parse_str, parse_bool
-from codaio_exporter.utils.ratelimit import AdaptiveRateLimit
+from codaio_exporter.api.parse import parse_str, parse_bool
+from codaio_exporter.utils.ratelimit import TokenBucketRateLimit
 from codaio_exporter.utils.retry import retry
 from codaio_exporter.utils.concurrencylimit import ConcurrencyLimit
+from codaio_exporter.api.etag_cache import PersistentETagCache
 
+# If `cache_dir` is set, responses are remembered there across runs and only downloaded again if they changed, see PersistentETagCache.
+# If `evict_untouched_cache_entries` is also set, cache entries this run didn't use are deleted once it completed successfully.
+# Only set it if the run requests everything that is worth keeping in the cache, e.g. when exporting all documents.
 @asynccontextmanager
-async def make_client(api_token: str) -> AsyncGenerator['Client', None]:
-    async with aiohttp.ClientSession() as session:
-        yield Client(session, api_token)
+async def make_client(api_token: str, cache_dir: Optional[str] = None, evict_untouched_cache_entries: bool = False) -> AsyncGenerator['Client', None]:
+    # All our requests go to the same host, so keep connections (and their TLS sessions) alive
+    # and cache DNS lookups instead of setting up new connections all the time.
+    # One session is shared by all requests of the run, and it allows as many connections as the Client can have requests in flight.
+    connector = aiohttp.TCPConnector(
+        limit=100,
+        limit_per_host=_MAX_CONCURRENT_REQUESTS + _MAX_CONCURRENT_MUTATION_POLLS,
+        ttl_dns_cache=300,
+        keepalive_timeout=60,
+        enable_cleanup_closed=True,
+    )
+    disk_cache = PersistentETagCache(cache_dir) if cache_dir is not None else None
+    async with aiohttp.ClientSession(connector=connector, json_serialize=_json_serialize) as session:
+        yield Client(session, api_token, disk_cache)
+    # Only reached if the run didn't fail
+    if disk_cache is not None and evict_untouched_cache_entries:
+        await disk_cache.remove_untouched_entries()
+
+def _json_serialize(data: Any) -> str:
+    return orjson.dumps(data).decode()
 
 
 class CodaError(Exception):
@@ -35,56 +57,78 @@ class ResponseFormatError(CodaError):
 
 
 _MAX_PAGE_SIZE = 200
+_MUTATION_POLL_INITIAL_DELAY_SEC = 0.25
+_MUTATION_POLL_MAX_DELAY_SEC = 5.0
 _API_ENDPOINT = "https://coda.io/apis/v1"
+_MAX_CONCURRENT_REQUESTS = 50
+_MAX_CONCURRENT_MUTATION_POLLS = 4
 
-_request_limit = AdaptiveRateLimit(TooManyRequests, 10)
-_concurrency_limit = ConcurrencyLimit(50)
+# coda.io allows 100 read requests and 10 write requests per 6 seconds. Stay below that instead of running into
+# TOO_MANY_REQUESTS errors, but still adapt if we hit them anyways. A full bucket plus what refills within
+# 6 seconds (burst + 6 * rate) must not exceed the limit, so half of it is the burst and the other half the rate.
+_request_limit = TokenBucketRateLimit(TooManyRequests, max_requests_per_sec=50 / 6, burst=50, backoff_interval_sec=10)
+_write_request_limit = TokenBucketRateLimit(TooManyRequests, max_requests_per_sec=5 / 6, burst=5, backoff_interval_sec=10)
+_concurrency_limit = ConcurrencyLimit(_MAX_CONCURRENT_REQUESTS)
+_mutation_poll_concurrency_limit = ConcurrencyLimit(_MAX_CONCURRENT_MUTATION_POLLS)
 
 RequestId = NewType('RequestId', str)
 
 
 @final
 class Client:
-    def __init__(self, session: aiohttp.ClientSession, api_token: str):
+    def __init__(self, session: aiohttp.ClientSession, api_token: str, disk_cache: Optional[PersistentETagCache] = None):
         self._session: Final = session
+        self._disk_cache: Final = disk_cache
         self._authorization: Final = {"Authorization": f"Bearer {api_token}"}
+        self._authorization_json: Final = {**self._authorization, "Content-Type": "application/json"}
 
+    # If `cache` is True and there is a disk cache, the request is sent as a conditional request if we've seen an ETag for it
+    # in a previous run, and the previous response is reused if the server says it is unchanged.
     @_concurrency_limit
-    async def get_item(self, endpoint: str, params: Dict[str, Any] = {}) -> Dict[str, Any]:
-        response = await self._get_item(endpoint, params=params)
+    async def get_item(self, endpoint: str, params: Dict[str, Any] = {}, cache: bool = False) -> Dict[str, Any]:
+        response = await self._get_item(endpoint, params=params, cache=cache)
         return response
 
     @retry(10)
     @_request_limit
-    async def _get_item(self, endpoint: str, params: Dict[str, Any] = {}) -> Dict[str, Any]:
+    async def _get_item(self, endpoint: str, params: Dict[str, Any] = {}, cache: bool = False) -> Dict[str, Any]:
         logging.info(f"GET {endpoint} {str(params)}")
-        async with self._session.get(_API_ENDPOINT + endpoint, params=params, headers=self._authorization) as response:
-            try:
-                await _handle_potential_error(response)
-                content = await response.json()
-                logging.info(f"GET {endpoint}: responded")
-            except aiohttp.client_exceptions.ContentTypeError as e:
-                content_text = await response.text()
-                raise ContentTypeError(f"Content type error for {content_text}", e)
-
-            return parse_dict_str_any(content)
+        content = await self._get(_full_url(endpoint), params, disk_cache=cache)
+        logging.info(f"GET {endpoint}: responded")
+        return content
 
 
+    # If there is a disk cache, pages are sent as conditional requests based on the previous run
     async def get_list(self, endpoint: str, params: Dict[str, Any] = {}) -> AsyncGenerator[Any, None]:
         logging.info(f"GET {endpoint} {str(params)}")
 
-        params["limit"] = _MAX_PAGE_SIZE
-
-        page = await self._get_page(_API_ENDPOINT + endpoint, params)
-        for item in page.pop("items"):
-            yield item
-
-        while page.get("nextPageLink") is not None:
-            nextPageLink = page.get("nextPageLink")
-            assert nextPageLink is not None
-            page = await self._get_page(nextPageLink, params={})
-            for item in page.pop("items"):
-                yield item
+        params = {**params, "limit": _MAX_PAGE_SIZE}
+
+        next_page: Optional[asyncio.Future[Dict[str, Any]]] = None
+        try:
+            page = await self._get_page(_full_url(endpoint), params)
+            while True:
+                # Already start fetching the next page while our caller is still processing the items of the current page
+                next_page_link = page.get("nextPageLink")
+                if next_page_link is not None:
+                    next_page = asyncio.ensure_future(self._get_page(next_page_link, params={}))
+
+                # Don't keep the current page alive while we wait for the next one
+                page_items = page.pop("items")
+                del page
+
+                for item in page_items:
+                    yield item
+                del page_items
+
+                if next_page is None:
+                    break
+                page = await next_page
+                next_page = None
+        finally:
+            # Don't leave a prefetch running if our caller stopped iterating early or we failed
+            if next_page is not None:
+                next_page.cancel()
 
         logging.info(f"GET {endpoint}: responded")
     
@@ -92,59 +136,91 @@ class Client:
     @retry(10)
     @_request_limit
     async def _get_page(self, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
-        async with self._session.get(url, params=params, headers=self._authorization) as response:
-            try:
-                await _handle_potential_error(response)
-                content = await response.json()
-            except aiohttp.client_exceptions.ContentTypeError as e:
-                content_text = await response.text()
-                raise ContentTypeError(f"Content type error for {content_text}", e)
-            return parse_dict_str_any(content)
+        return await self._get(url, params, disk_cache=True)
+
+    # `disk_cache` enables the persistent ETag cache for this request, if the client has one
+    async def _get(self, url: str, params: Dict[str, Any], disk_cache: bool) -> Dict[str, Any]:
+        cache_key = (url, tuple(sorted(params.items())))
+        cached = None
+        if self._disk_cache is not None and disk_cache:
+            cached = await self._disk_cache.get(repr(cache_key))
+        headers = self._authorization if cached is None else {**self._authorization, "If-None-Match": cached[0]}
+        async with self._session.get(url, params=params, headers=headers) as response:
+            if cached is not None and response.status == 304:
+                # Callers may modify the dict we return (e.g. get_list pops the items), so hand out a copy
+                return dict(cached[1])
+            await _handle_potential_error(response)
+            result = _check_is_dict(await _read_json(response))
+            etag = response.headers.get("ETag")
+        # The connection is already released, don't hold on to it while writing to the disk cache
+        if etag is not None and self._disk_cache is not None and disk_cache:
+            await self._disk_cache.put(repr(cache_key), etag, result)
+        return result
+
+    # Waiting for completion happens outside of the concurrency limit and the retry loop of the request itself,
+    # so that pending mutations don't block new requests and a failing status poll doesn't re-issue the mutation.
+    async def post(self, endpoint: str, data: Dict[str, Any], on_issued: Optional[Callable[[], None]] = None, wait_for_completion: bool = True) -> RequestId:
+        request_id = await self._post(endpoint, data)
+        if on_issued is not None:
+            on_issued()
+        if wait_for_completion:
+            await self._wait_until_mutation_is_completed(request_id)
+            logging.info(f"POST {endpoint}: completed")
+        return request_id
 
     @_concurrency_limit
     @retry(10)
-    @_request_limit
-    async def post(self, endpoint: str, data: Dict[str, Any], on_issued: Optional[Callable[[], None]] = None, wait_for_completion: bool = True) -> RequestId:
+    @_write_request_limit
+    async def _post(self, endpoint: str, data: Dict[str, Any]) -> RequestId:
         logging.info(f"POST {endpoint}")
         async with self._session.post(
-            _API_ENDPOINT + endpoint,
+            _full_url(endpoint),
             json=data,
-            headers={**self._authorization, "Content-Type": "application/json"},
+            headers=self._authorization_json,
         ) as response:
             request_id = await _handle_mutation_response(response)
             logging.info(f"POST {endpoint}: responded")
-            if on_issued is not None:
-                on_issued()
-            if wait_for_completion:
-                await self._wait_until_mutation_is_completed(request_id)
-                logging.info(f"POST {endpoint}: completed")
             return request_id
 
+    async def delete(self, endpoint: str, data: Dict[str, Any] = {}, on_issued: Optional[Callable[[], None]] = None, wait_for_completion: bool = True) -> RequestId:
+        request_id = await self._delete(endpoint, data)
+        if on_issued is not None:
+            on_issued()
+        if wait_for_completion:
+            await self._wait_until_mutation_is_completed(request_id)
+            logging.info(f"DELETE {endpoint}: completed")
+        return request_id
+
     @_concurrency_limit
     @retry(10)
-    @_request_limit
-    async def delete(self, endpoint: str, data: Dict[str, Any] = {}, on_issued: Optional[Callable[[], None]] = None, wait_for_completion: bool = True) -> RequestId:
+    @_write_request_limit
+    async def _delete(self, endpoint: str, data: Dict[str, Any]) -> RequestId:
         logging.info(f"DELETE {endpoint} {str(data)}")
 
-        async with self._session.delete(_API_ENDPOINT + endpoint, json=data, headers=self._authorization) as response:
+        async with self._session.delete(_full_url(endpoint), json=data, headers=self._authorization) as response:
             request_id = await _handle_mutation_response(response)
             logging.info(f"DELETE {endpoint}: responded")
-            if on_issued is not None:
-                on_issued()
-            if wait_for_completion:
-                await self._wait_until_mutation_is_completed(request_id)
-                logging.info(f"DELETE {endpoint}: completed")
             return request_id
 
-    async def _get_mutation_is_completed(self, request_id: RequestId) -> bool:
-        response = await self._get_item(f"/mutationStatus/{request_id}")
+    # Status polls have their own, smaller concurrency limit so they can't crowd out actual requests
+    @_mutation_poll_concurrency_limit
+    async def _get_mutation_is_completed(self, status_endpoint: str) -> bool:
+        response = await self._get_item(status_endpoint)
         if "completed" not in response:
             raise ResponseFormatError(f"Expected 'completed' to be in response but response was {response}")
         return parse_bool(response["completed"])
     
     async def _wait_until_mutation_is_completed(self, request_id: RequestId) -> None:
-        while not await self._get_mutation_is_completed(request_id):
-            await asyncio.sleep(1)
+        status_endpoint = f"/mutationStatus/{request_id}"
+        # Small mutations usually complete quickly, but long running ones shouldn't keep eating into our rate limit
+        # with a poll every second, so poll with exponential backoff.
+        delay = _MUTATION_POLL_INITIAL_DELAY_SEC
+        while not await self._get_mutation_is_completed(status_endpoint):
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, _MUTATION_POLL_MAX_DELAY_SEC)
+
+def _full_url(endpoint: str) -> str:
+    return _API_ENDPOINT + endpoint
 
 async def _handle_potential_error(response: aiohttp.ClientResponse) -> None:
     if response.ok:
@@ -163,6 +239,24 @@ async def _handle_potential_error(response: aiohttp.ClientResponse) -> None:
         f'Status code: {response.status}. Message: {content["message"]}'
     )
 
+# Like response.json(), but lets orjson parse the raw bytes instead of decoding them to a str first
+async def _read_json(response: aiohttp.ClientResponse) -> Any:
+    content_type = response.content_type
+    if content_type != "application/json" and not (content_type.startswith("application/") and content_type.endswith("+json")):
+        content_text = await response.text()
+        raise ContentTypeError(f"Content type error for {content_text}")
+    body = await response.read()
+    try:
+        return orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        raise ResponseFormatError(f"Expected response to be JSON but response was {body!r}", e)
+
+def _check_is_dict(content: Any) -> Dict[str, Any]:
+    # Keys of decoded JSON objects are always strings, no need to check them one by one
+    if not isinstance(content, dict):
+        raise ResponseFormatError(f"Expected response to be a JSON object but response was {content}")
+    return content
+
 async def _handle_mutation_response(response: aiohttp.ClientResponse) -> RequestId:
     try:
         await _handle_potential_error(response)
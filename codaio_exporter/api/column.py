@@ -1,27 +1,30 @@
 from typing import Dict, Any, Optional, final, Final
 from codaio_exporter.api.parse import parse_str, parse_bool
-from ensure import check  # type: ignore
 
 
 @final
 class ColumnAPI:
+    __slots__ = ("_data", "_id", "_name", "_calculated", "_formula")
+
     def __init__(self, data: Dict[str, Any]):
         self._data: Final = data
+        self._id: Final = parse_str(data["id"])
+        self._name: Final = parse_str(data["name"])
+        self._calculated: Final = "calculated" in data and parse_bool(data["calculated"])
+        self._formula: Final = parse_str(data["formula"]) if "formula" in data else None
 
     def id(self) -> str:
-        return parse_str(self._data["id"])
+        return self._id
 
     def raw_data(self) -> Dict[str, Any]:
         return self._data
 
     def name(self) -> str:
-        return parse_str(self._data["name"])
+        return self._name
     
     def calculated(self) -> bool:
-        return "calculated" in self._data and parse_bool(self._data["calculated"])
+        return self._calculated
 
     def formula(self) -> Optional[str]:
-        if "formula" in self._data:
-            return parse_str(self._data["formula"])
-        else:
-            return None
+        return self._formula
+
@@ -1,4 +1,5 @@
 from typing import Dict, Any, AsyncGenerator, final, Final, Optional
+from functools import cached_property
 from codaio_exporter.api.client import Client
 from codaio_exporter.api.parse import parse_str
 from codaio_exporter.api.table import TableAPI
@@ -9,30 +10,41 @@ class DocAPI:
     def __init__(self, client: Client, data: Dict[str, Any]):
         self._client: Final = client
         self._data: Final = data
-        self._api_root: Final = f"/docs/{self.id()}"
+        self._id: Final = parse_str(data["id"])
+        self._name: Final = parse_str(data["name"])
+        self._api_root: Final = f"/docs/{self._id}"
+        self._tables_endpoint: Final = f"{self._api_root}/tables"
 
     def raw_data(self) -> Dict[str, Any]:
         return self._data
 
     def id(self) -> str:
-        return parse_str(self._data["id"])
+        return self._id
 
     def name(self) -> str:
-        return parse_str(self._data["name"])
+        return self._name
 
     def folder_id(self) -> str:
-        return parse_str(self._data["folder"]["id"])
+        return self._folder_id
     
     def folder_name(self) -> Optional[str]:
+        return self._folder_name
+
+    @cached_property
+    def _folder_id(self) -> str:
+        return parse_str(self._data["folder"]["id"])
+
+    @cached_property
+    def _folder_name(self) -> Optional[str]:
         if "name" in self._data["folder"]:
             return parse_str(self._data["folder"]["name"])
         else:
             return None
 
     async def get_all_tables(self) -> AsyncGenerator[TableAPI, None]:
-        async for table in self._client.get_list(f"{self._api_root}/tables"):
+        async for table in self._client.get_list(self._tables_endpoint):
             yield TableAPI(self._client, self._api_root, table)
 
     async def get_table(self, table_id: str) -> TableAPI:
-        table = await self._client.get_item(f"{self._api_root}/tables/{table_id}")
+        table = await self._client.get_item(f"{self._tables_endpoint}/{table_id}", cache=True)
         return TableAPI(self._client, self._api_root, table)
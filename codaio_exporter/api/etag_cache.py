@@ -0,0 +1,62 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from typing import Dict, Any, Optional, Set, Tuple, final, Final
+import orjson
+
+
+# Remembers the ETag and body of GET responses across runs, so that resources that didn't change since the last run
+# can be requested with If-None-Match and don't need to be downloaded again.
+# Each entry is stored as a separate file named after the hash of its key.
+# Page URLs contain page tokens that change between runs, so entries that a run of a full export didn't use are deleted
+# at the end of the run (see remove_untouched_entries()), otherwise the cache would grow with every run.
+@final
+class PersistentETagCache:
+    def __init__(self, cache_dir: str):
+        self._cache_dir: Final = cache_dir
+        # File names of the entries this run looked up or stored
+        self._touched: Final[Set[str]] = set()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    async def get(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        return await asyncio.to_thread(self._get_sync, key)
+
+    async def put(self, key: str, etag: str, body: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._put_sync, key, etag, body)
+
+    # Only call this after a successful run that requested everything, otherwise entries of the parts that weren't exported would be lost
+    async def remove_untouched_entries(self) -> None:
+        await asyncio.to_thread(self._remove_untouched_entries_sync)
+
+    def _remove_untouched_entries_sync(self) -> None:
+        for name in os.listdir(self._cache_dir):
+            if name.endswith(".json") and name not in self._touched:
+                try:
+                    os.remove(os.path.join(self._cache_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def _path(self, key: str) -> str:
+        name = hashlib.sha256(key.encode()).hexdigest() + ".json"
+        self._touched.add(name)
+        return os.path.join(self._cache_dir, name)
+
+    def _get_sync(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        try:
+            with open(self._path(key), 'rb') as file:
+                entry = orjson.loads(file.read())
+        except FileNotFoundError:
+            return None
+        return entry["etag"], entry["body"]
+
+    def _put_sync(self, key: str, etag: str, body: Dict[str, Any]) -> None:
+        # Write to a temporary file first and then move it into place, so that an interrupted run can't leave a partial entry behind
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(orjson.dumps({"etag": etag, "body": body}))
+            os.replace(tmp_path, self._path(key))
+        except:
+            os.remove(tmp_path)
+            raise
@@ -1,28 +1,27 @@
 from typing import Any, Dict
-from ensure import check  # type: ignore
+
+# These are called for every id, name and cell we read from the API, so they're kept as cheap as possible.
 
 def parse_int(v: Any) -> int:
-    check(v).is_a(int).or_raise(
-        lambda _: Exception(f"Tried to read {v} as int"))
-    assert isinstance(v, int)
+    if not isinstance(v, int):
+        raise Exception(f"Tried to read {v} as int")
     return v
 
 def parse_str(v: Any) -> str:
-    check(v).is_a(str).or_raise(
-        lambda _: Exception(f"Tried to read {v} as str"))
-    assert isinstance(v, str)
+    if not isinstance(v, str):
+        raise Exception(f"Tried to read {v} as str")
     return v
 
 def parse_bool(v: Any) -> bool:
-    check(v).is_a(bool).or_raise(
-        lambda _: Exception(f"Tried to read {v} as bool"))
-    assert isinstance(v, bool)
+    if not isinstance(v, bool):
+        raise Exception(f"Tried to read {v} as bool")
     return v
 
 def parse_dict_str_any(v: Any) -> Dict[str, Any]:
-    check(v).is_a(Dict).or_raise(
-        lambda _: Exception(f"Tried to read {v} as Dict"))
-    assert isinstance(v, Dict)
-    for key in v.keys():
-        parse_str(key)
+    if not isinstance(v, Dict):
+        raise Exception(f"Tried to read {v} as Dict")
+    # Keys of decoded JSON objects are always strings, so only check them in debug runs
+    if __debug__:
+        for key in v.keys():
+            parse_str(key)
     return v
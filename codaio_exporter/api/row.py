@@ -1,26 +1,39 @@
-from typing import Dict, Any, final, Final
+from typing import Dict, Any, List, Tuple, final, Final
 from codaio_exporter.api.parse import parse_str, parse_int
 
 
 @final
 class RowAPI:
+    # There can be a lot of these (e.g. one per row), so don't give each of them a __dict__
+    __slots__ = ("_data", "_id", "_name", "_index")
+
     def __init__(self, data: Dict[str, Any]):
         self._data: Final = data
+        self._id: Final = parse_str(data["id"])
+        self._name: Final = parse_str(data["name"])
+        self._index: Final = parse_int(data["index"])
 
     def raw_data(self) -> Dict[str, Any]:
         return self._data
 
     def id(self) -> str:
-        return parse_str(self._data["id"])
+        return self._id
     
     def name(self) -> str:
-        return parse_str(self._data["name"])
+        return self._name
     
     def index(self) -> int:
-        return parse_int(self._data["index"])
+        return self._index
     
     def num_cells(self) -> int:
         return len(self._data["values"])
     
     def get_cell_value(self, column_id: str) -> str:
         return str(self._data["values"][column_id])
+
+
+# The cell values of a raw row dict as returned by the API, in the order of `column_ids`.
+# Cheaper than wrapping the row in a RowAPI and calling get_cell_value() for each column.
+def cell_values_in_order(row_data: Dict[str, Any], column_ids: Tuple[str, ...]) -> List[str]:
+    values = row_data["values"]
+    return [str(values[column_id]) for column_id in column_ids]
@@ -1,9 +1,16 @@
-from typing import Dict, Any, AsyncGenerator, List, Optional, Callable, final, Final
+from typing import Dict, Any, AsyncGenerator, List, Optional, Callable, TypeVar, final, Final
 from enum import Enum
 from codaio_exporter.api.parse import parse_str
 from codaio_exporter.api.column import ColumnAPI
 from codaio_exporter.api.row import RowAPI
 from codaio_exporter.api.client import Client
+from codaio_exporter.utils.gather import gather_cancel_on_first_error
+
+T = TypeVar('T')
+
+# Large deletions and insertions are split into multiple requests of at most this many rows, to stay below coda.io's limit
+# for the size of a request.
+_MAX_ROWS_PER_MUTATION = 500
 
 
 @final
@@ -12,55 +19,86 @@ class TableType(Enum):
     table = "table"
 
     def to_str(self) -> str:
-        if self == TableType.view:
-            return "view"
-        elif self == TableType.table:
-            return "table"
-        else:
-            raise Exception(f"Unknown table type {self}")
+        return self.value
 
 
 @final
 class TableAPI:
+    __slots__ = ("_data", "_client", "_id", "_name", "_type", "_api_root", "_columns_endpoint", "_rows_endpoint")
+
     def __init__(self, client: Client, doc_api_root: str, data: Dict[str, Any]):
         self._data: Final = data
         self._client: Final = client
-        self._api_root: Final = f"{doc_api_root}/tables/{self.id()}"
+        self._id: Final = parse_str(data["id"])
+        self._name: Final = parse_str(data["name"])
+        self._type: Final = TableType(parse_str(data["tableType"]))
+        self._api_root: Final = f"{doc_api_root}/tables/{self._id}"
+        self._columns_endpoint: Final = f"{self._api_root}/columns"
+        self._rows_endpoint: Final = f"{self._api_root}/rows"
 
     def raw_data(self) -> Dict[str, Any]:
         return self._data
 
     def id(self) -> str:
-        return parse_str(self._data["id"])
+        return self._id
 
     def name(self) -> str:
-        return parse_str(self._data["name"])
+        return self._name
 
     def type(self) -> TableType:
-        parsed = parse_str(self._data["tableType"])
-        if parsed == "view":
-            return TableType.view
-        elif parsed == "table":
-            return TableType.table
-        else:
-            raise Exception(f"Unknown table type {parsed}")
+        return self._type
 
     async def get_all_columns(self) -> AsyncGenerator[ColumnAPI, None]:
-        async for column in self._client.get_list(f"{self._api_root}/columns"):
+        async for column in self._client.get_list(self._columns_endpoint):
             yield ColumnAPI(column)
 
     async def get_all_rows(self) -> AsyncGenerator[RowAPI, None]:
-        async for row in self._client.get_list(f"{self._api_root}/rows"):
+        async for row in self._client.get_list(self._rows_endpoint):
             yield RowAPI(row)
 
+    # Like get_all_rows() but yields the raw row dicts without wrapping them into RowAPI objects.
+    # Used by the export, which needs to process every single row.
+    async def iter_raw_rows(self) -> AsyncGenerator[Dict[str, Any], None]:
+        async for row in self._client.get_list(self._rows_endpoint):
+            yield row
+
+    # `on_issued` is called once, after all requests were issued. The order of deletions doesn't matter, so the requests run concurrently.
     async def delete_rows(self, row_ids: List[str], on_issued: Optional[Callable[[], None]] = None) -> None:
-        await self._client.delete(f"{self._api_root}/rows", data={"rowIds": row_ids}, on_issued=on_issued)
+        chunks = _split_into_chunks(row_ids)
+        on_chunk_issued = _call_after_all_issued(len(chunks), on_issued)
+        await gather_cancel_on_first_error(*(
+            self._client.delete(self._rows_endpoint, data={"rowIds": chunk}, on_issued=on_chunk_issued)
+            for chunk in chunks
+        ))
 
-    # Each entry of rows is a Dict from column id to value
+    # Each entry of rows is a Dict from column id to value. `on_issued` is called once, after all requests were issued.
+    # The requests are sent one after the other, each one after the previous one completed, so that the rows end up in the same order as in `rows`.
     async def insert_rows(self, rows: List[Dict[str, str]], on_issued: Optional[Callable[[], None]] = None) -> None:
         def format_cell(column: str, value: str) -> Dict[str, str]:
             return {"column": column, "value": value}
         def format_row(row: Dict[str, str]) -> List[Dict[str, str]]:
             return [format_cell(column, value) for (column, value) in row.items()]
-        rows_data = [{"cells": format_row(row)} for row in rows]
-        await self._client.post(f"{self._api_root}/rows", data={"rows": rows_data}, on_issued=on_issued)
+        chunks = _split_into_chunks([{"cells": format_row(row)} for row in rows])
+        on_chunk_issued = _call_after_all_issued(len(chunks), on_issued)
+        for chunk in chunks:
+            await self._client.post(self._rows_endpoint, data={"rows": chunk}, on_issued=on_chunk_issued)
+
+
+def _split_into_chunks(items: List[T]) -> List[List[T]]:
+    return [items[start:start + _MAX_ROWS_PER_MUTATION] for start in range(0, len(items), _MAX_ROWS_PER_MUTATION)]
+
+# Returns a callback that calls `on_issued` once it was called for each of the `num_requests` requests.
+# If there are no requests at all, there's nothing to wait for and `on_issued` is called right away.
+def _call_after_all_issued(num_requests: int, on_issued: Optional[Callable[[], None]]) -> Optional[Callable[[], None]]:
+    if on_issued is None:
+        return None
+    if num_requests == 0:
+        on_issued()
+        return None
+    remaining = num_requests
+    def on_request_issued() -> None:
+        nonlocal remaining
+        remaining -= 1
+        if remaining == 0:
+            on_issued()
+    return on_request_issued
@@ -1,9 +1,10 @@
 import os
 import asyncio
-import json
+import gzip
+import orjson
 import yaml
-from typing import List, Optional, final, Dict, Any
-import aiofiles
+from dataclasses import dataclass
+from typing import Callable, List, Optional, TextIO, Tuple, Union, final, Dict, Any
 
 from codaio_exporter.utils.gather import gather_raise_first_error_after_all_tasks_complete
 from codaio_exporter.utils.generator import collect, concurrent_async_for
@@ -11,10 +12,19 @@ from codaio_exporter.api import make_api
 from codaio_exporter.api.doc import DocAPI
 from codaio_exporter.api.table import TableAPI
 from codaio_exporter.api.column import ColumnAPI
-from codaio_exporter.api.row import RowAPI
 from codaio_exporter.table import Table, Row, parse_table_from_api
 from codaio_exporter.progress import ProgressDisplay, ProgressBar
 
+# The libyaml based dumper is several times faster, but PyYAML can be installed without libyaml
+try:
+    from yaml import CSafeDumper as _YamlDumper
+except ImportError:
+    from yaml import SafeDumper as _YamlDumper  # type: ignore
+
+
+# Path and content of a file to write. Content is written in binary mode if it is bytes and in text mode if it is a str.
+_File = Tuple[str, Union[str, bytes]]
+
 
 @final
 class ProgressHandler:
@@ -33,77 +43,115 @@ class ProgressHandler:
             self._bar.increment_total(update=False)
 
 
-async def export_all_docs(api_token: str, dest_path: str, progress_display: Optional[ProgressDisplay] = None) -> None:
+# Options changing what the export writes. The defaults produce the regular export layout.
+@final
+@dataclass(frozen=True)
+class ExportOptions:
+    # Write the raw rows of each table into a single rows.jsonl file (one JSON object per line, in row order)
+    # instead of a JSON and a YAML file per row in the rows directory. Much faster for large tables.
+    rows_jsonl: bool = False
+    # Write the JSON files gzip compressed (with a .gz extension). This writes much less data, especially for large tables.
+    # The YAML, CSV and HTML files stay uncompressed so they can still be read directly.
+    compress: bool = False
+    # Next to each JSON file, also write a YAML file with the same data. Generating YAML is the slowest part of serializing,
+    # and nothing reads these files back, so turning this off makes exports faster if the YAML files aren't needed.
+    yaml: bool = True
+
+
+# If `cache_dir` is set, data downloaded from coda.io is remembered there and later exports only download it again if it changed.
+async def export_all_docs(api_token: str, dest_path: str, progress_display: Optional[ProgressDisplay] = None, cache_dir: Optional[str] = None, options: ExportOptions = ExportOptions()) -> None:
     os.makedirs(dest_path, exist_ok=False)
-    async with make_api(api_token) as api:
+    # This exports everything, so cache entries that weren't used (e.g. for deleted documents or outdated page tokens) can go.
+    # export_doc() must not evict, the cache directory might also hold the entries of other documents.
+    async with make_api(api_token, cache_dir, evict_untouched_cache_entries=True) as api:
         # We could use concurrent_async_for for more concurrency (i.e. already downloading data for the first document while we're still finding new documents)
         # but that looks a bit weird in the UI since the `max_progress` property of the progress bar would keep increasing. So instead, let's enumerate
         # all documents first and then start querying the data.
         documents = await collect(api.get_all_docs())
-        await gather_raise_first_error_after_all_tasks_complete(*(_export_doc(dest_path, doc, progress_display) for doc in documents))
+        await gather_raise_first_error_after_all_tasks_complete(*(_export_doc(dest_path, doc, progress_display, options) for doc in documents))
 
-async def export_doc(api_token: str, dest_path: str, doc_id: str, progress_display: Optional[ProgressDisplay] = None) -> None:
+async def export_doc(api_token: str, dest_path: str, doc_id: str, progress_display: Optional[ProgressDisplay] = None, cache_dir: Optional[str] = None, options: ExportOptions = ExportOptions()) -> None:
     os.makedirs(dest_path, exist_ok=False)
-    async with make_api(api_token) as api:
+    async with make_api(api_token, cache_dir) as api:
         doc = await api.get_doc(doc_id)
-        await _export_doc(dest_path, doc, progress_display)
+        await _export_doc(dest_path, doc, progress_display, options)
 
-async def _export_doc(dest_path: str, doc: DocAPI, progress_display: Optional[ProgressDisplay]) -> None:
+async def _export_doc(dest_path: str, doc: DocAPI, progress_display: Optional[ProgressDisplay], options: ExportOptions) -> None:
     doc_path = _doc_path(dest_path, doc)
-    os.makedirs(doc_path, exist_ok=False)
-    await _write_structured_data_to_file(os.path.join(doc_path, "api_object"), doc.raw_data())
-
     progress_handler = ProgressHandler(doc.name(), progress_display)
-    # We could use concurrent_async_for for more concurrency (i.e. already downloading data for the first tables while we're still finding new tables)
-    # but that looks a bit weird in the UI since the `max_progress` property of the progress bar would keep increasing. So instead, let's enumerate
-    # all tables first and then start querying the data.
-    tables = await collect(doc.get_all_tables(), lambda: progress_handler.increment_total())
-    await gather_raise_first_error_after_all_tasks_complete(*(_export_table(doc_path, table, progress_handler) for table in tables))
-
-async def _export_table(doc_path: str, table: TableAPI, progress_handler: ProgressHandler) -> None:
-    # TODO We can improve concurrency in this function
-    table_path = _table_path(doc_path, table)
-    os.makedirs(table_path, exist_ok=False)
-    await _write_structured_data_to_file(os.path.join(table_path, "api_object"), table.raw_data())
-    columns, rows = await asyncio.gather(
-        collect(table.get_all_columns()),
-        collect(table.get_all_rows())
+    await asyncio.to_thread(os.makedirs, doc_path, exist_ok=False)
+    # Already start exporting the first tables while we're still finding more tables. This means the total of the progress bar
+    # keeps increasing while tables are found, but for documents with many tables, downloading can start much earlier.
+    async def export_table(table: TableAPI) -> None:
+        progress_handler.increment_total()
+        await _export_table(doc_path, table, progress_handler, options)
+    await gather_raise_first_error_after_all_tasks_complete(
+        _write_structured_data_to_file(os.path.join(doc_path, "api_object"), doc.raw_data(), options),
+        concurrent_async_for(doc.get_all_tables(), export_table, max_concurrency=_MAX_CONCURRENT_TABLES),
     )
+
+# The client already limits concurrent requests, but without this, all tables of a document would be downloaded at the same time
+# and kept in memory until they're all done. Limiting the number of tables in flight lets tables finish (and free their rows) one after the other.
+# The limit is applied when taking tables from the table list, so tables beyond it don't even get a task until a slot is free.
+_MAX_CONCURRENT_TABLES = 32
+
+async def _export_table(doc_path: str, table: TableAPI, progress_handler: ProgressHandler, options: ExportOptions) -> None:
+    table_path = _table_path(doc_path, table)
+    # Create all directories of the table in one go, off the event loop
+    await asyncio.to_thread(_make_table_dirs, table_path, options)
+    # Already start downloading columns and rows while the api object is still being written
     await gather_raise_first_error_after_all_tasks_complete(*(
-        _export_columns(table_path, columns),
-        _export_rows(table_path, table, columns, rows),
+        _write_structured_data_to_file(os.path.join(table_path, "api_object"), table.raw_data(), options),
+        _export_table_contents(table_path, table, options),
     ))
     progress_handler.increment_done()
 
-async def _export_columns(table_path: str, columns: List[ColumnAPI]) -> None:
-    columns_path = os.path.join(table_path, "columns")
-    os.makedirs(columns_path, exist_ok=False)
-    num_columns = len(columns)
+async def _export_table_contents(table_path: str, table: TableAPI, options: ExportOptions) -> None:
+    columns, rows = await asyncio.gather(
+        collect(table.get_all_columns()),
+        collect(table.iter_raw_rows())
+    )
+    # Parsing and serializing a large table is a lot of CPU work. Do it in a worker thread so the event loop stays responsive for the downloads of other tables.
+    table_data, files = await asyncio.to_thread(_parse_table, table_path, table, columns, rows, options)
     await gather_raise_first_error_after_all_tasks_complete(*(
-        _write_structured_data_to_file(os.path.join(columns_path, _column_name_for_path(index, column, num_columns)), column.raw_data())
-        for (index, column) in enumerate(columns)
+        _write_files(files),
+        _stream_to_file(os.path.join(table_path, "table.csv"), table_data.write_csv),
+        _stream_to_file(os.path.join(table_path, "table.html"), table_data.write_html),
     ))
 
-async def _export_rows(table_path: str, table_api: TableAPI, columns: List[ColumnAPI], rows: List[RowAPI]) -> None:
-    table = parse_table_from_api(table_api.id(), table_api.name(), columns, rows)
-    table_csv = table.to_csv()
-    table_html = table.to_html()
-    table_json = table.to_json()
-    table_data = json.loads(table_json)
-    await gather_raise_first_error_after_all_tasks_complete(*(
-        _write_raw_json_row_files(table.rows, os.path.join(table_path, "rows")),
-        _write_file(os.path.join(table_path, "table.csv"), table_csv),
-        _write_file(os.path.join(table_path, "table.html"), table_html),
-        _write_structured_data_to_file(os.path.join(table_path, "table"), table_data),
-    ))
+def _parse_table(table_path: str, table: TableAPI, columns: List[ColumnAPI], rows: List[Dict[str, Any]], options: ExportOptions) -> Tuple[Table, List[_File]]:
+    table_data = parse_table_from_api(table.id(), table.name(), columns, rows)
+    # Collect all the small files of this table so they can be written in batches instead of one by one
+    files = _column_files(_columns_path(table_path), columns, options) + _structured_data_files(os.path.join(table_path, "table"), table_data.to_dict(), options)
+    if options.rows_jsonl:
+        files.append(_rows_jsonl_file(table_path, table_data.rows, options))
+    else:
+        files += _raw_json_row_files(_rows_path(table_path), table_data.rows, options)
+    return table_data, files
 
-async def _write_raw_json_row_files(rows: List[Row], folder: str) -> None:
-    os.makedirs(folder, exist_ok=False)
-    num_rows = len(rows)
-    await gather_raise_first_error_after_all_tasks_complete(*(
-        _write_structured_data_to_file(os.path.join(folder, _row_name_for_path(row, num_rows)), row.raw_data)
+def _rows_jsonl_file(table_path: str, rows: List[Row], options: ExportOptions) -> _File:
+    return _json_file(os.path.join(table_path, "rows.jsonl"), b"".join([orjson.dumps(row.raw_data, option=orjson.OPT_APPEND_NEWLINE) for row in rows]), options)
+
+# These build one path per column or row, so they join paths directly instead of going through the much slower os.path.join().
+# The file names are never absolute paths, so the result is the same.
+
+def _column_files(columns_path: str, columns: List[ColumnAPI], options: ExportOptions) -> List[_File]:
+    num_digits = _num_digits(len(columns))
+    prefix = columns_path + os.sep
+    return [
+        file
+        for (index, column) in enumerate(columns)
+        for file in _structured_data_files(prefix + _column_name_for_path(index, column, num_digits), column.raw_data(), options)
+    ]
+
+def _raw_json_row_files(rows_path: str, rows: List[Row], options: ExportOptions) -> List[_File]:
+    num_digits = _num_digits(len(rows))
+    prefix = rows_path + os.sep
+    return [
+        file
         for row in rows
-    ))
+        for file in _structured_data_files(prefix + _row_name_for_path(row, num_digits), row.raw_data, options)
+    ]
 
 def _doc_path(root_path: str, doc: DocAPI) -> str:
     folder_name = doc.folder_name() or "NO_FOLDER_NAME"
@@ -115,33 +163,105 @@ def _table_path(doc_path: str, table: TableAPI) -> str:
     table_name = _remove_path_unsafe_characters(table.name() + " " + table.id())
     return os.path.join(doc_path, "tables", table.type().to_str(), table_name)
 
-def _column_name_for_path(index: int, column: ColumnAPI, num_columns: int) -> str:
-    return _remove_path_unsafe_characters(f"{_format_index(index, num_columns)} - {column.id()} - {column.name()}")
+def _table_subdirs(table_path: str, options: ExportOptions) -> List[str]:
+    if options.rows_jsonl:
+        return [_columns_path(table_path)]
+    return [_columns_path(table_path), _rows_path(table_path)]
+
+def _columns_path(table_path: str) -> str:
+    return os.path.join(table_path, "columns")
 
-def _row_name_for_path(row: Row, num_rows: int) -> str:
+def _rows_path(table_path: str) -> str:
+    return os.path.join(table_path, "rows")
+
+def _column_name_for_path(index: int, column: ColumnAPI, num_digits: int) -> str:
+    return _remove_path_unsafe_characters(f"{_format_index(index, num_digits)} - {column.id()} - {column.name()}")
+
+def _row_name_for_path(row: Row, num_digits: int) -> str:
     if len(row.name) > 100:
         row_name = "ROWNAME_TOO_LONG"
     else:
         row_name = row.name
-    return _remove_path_unsafe_characters(f"{_format_index(row.index, num_rows)} - {row.id} - {row_name}")
+    return _remove_path_unsafe_characters(f"{_format_index(row.index, num_digits)} - {row.id} - {row_name}")
 
 def _remove_path_unsafe_characters(name: str) -> str:
+    if '/' not in name:
+        return name
     return name.replace('/', '_')
 
-def _format_index(index: int, max_index: int) -> str:
-    num_digits = len(str(max_index))
-    return str(index).zfill(num_digits)
+# Number of digits that _format_index() pads to so that all indices up to `max_index` sort correctly.
+# Computed once per table instead of once per row or column.
+def _num_digits(max_index: int) -> int:
+    return len(str(max_index))
 
-# Semaphore to make sure we don't get 'too many open files'
-write_semaphore = asyncio.Semaphore(512)
+def _format_index(index: int, num_digits: int) -> str:
+    return str(index).zfill(num_digits)
 
-async def _write_file(path: str, content: str) -> None:
-    async with write_semaphore:
-        async with aiofiles.open(path, 'w') as file:
-            await file.write(content)
+# Number of files written per thread hop. Large enough to amortize the hop, small enough that the files
+# of a large table are still written by several threads in parallel.
+_WRITE_BATCH_SIZE = 64
 
-async def _write_structured_data_to_file(path_without_extension: str, data: Dict[str, Any]) -> None:
+async def _write_files(files: List[_File]) -> None:
     await gather_raise_first_error_after_all_tasks_complete(*(
-        _write_file(path_without_extension + ".json", json.dumps(data)),
-        _write_file(path_without_extension + ".yaml", yaml.dump(data))
+        _write_file_batch(files[start:start + _WRITE_BATCH_SIZE])
+        for start in range(0, len(files), _WRITE_BATCH_SIZE)
     ))
+
+# Open, write and close all files of the batch in a single thread hop instead of dispatching each of these calls to the thread pool separately.
+# Each worker thread only has one file open at a time, so the size of the thread pool already makes sure we don't get 'too many open files'.
+async def _write_file_batch(files: List[_File]) -> None:
+    await asyncio.to_thread(_write_files_sync, files)
+
+def _make_table_dirs(table_path: str, options: ExportOptions) -> None:
+    # The parent directories of the table are shared with other tables of the document, so they might or might not exist yet
+    os.makedirs(table_path, exist_ok=False)
+    # The table directory was just created, so its subdirectories don't need os.makedirs() to check each of their ancestors first
+    for path in _table_subdirs(table_path, options):
+        os.mkdir(path)
+
+# For large content, let `write` stream it into the file instead of building it in memory first
+async def _stream_to_file(path: str, write: Callable[[TextIO], None]) -> None:
+    await asyncio.to_thread(_stream_to_file_sync, path, write)
+
+def _stream_to_file_sync(path: str, write: Callable[[TextIO], None]) -> None:
+    # newline='' because the csv module writes its own \r\n line endings, which shouldn't be translated again (e.g. to \r\r\n on Windows)
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        write(file)
+
+def _write_files_sync(files: List[_File]) -> None:
+    for path, content in files:
+        if isinstance(content, bytes):
+            _write_bytes_sync(path, content)
+        else:
+            with open(path, 'w', encoding='utf-8') as text_file:
+                text_file.write(content)
+
+# The content is already complete, so write it with plain syscalls instead of going through a buffered file object.
+# That's noticeably cheaper for the many small JSON files.
+def _write_bytes_sync(path: str, content: bytes) -> None:
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        remaining = memoryview(content)
+        while remaining:
+            remaining = remaining[os.write(fd, remaining):]
+    finally:
+        os.close(fd)
+
+# Serialize and write in the same thread hop, so that the serialization (especially to YAML) doesn't block the event loop either
+async def _write_structured_data_to_file(path_without_extension: str, data: Dict[str, Any], options: ExportOptions) -> None:
+    await asyncio.to_thread(_write_structured_data_to_file_sync, path_without_extension, data, options)
+
+def _write_structured_data_to_file_sync(path_without_extension: str, data: Dict[str, Any], options: ExportOptions) -> None:
+    _write_files_sync(_structured_data_files(path_without_extension, data, options))
+
+def _structured_data_files(path_without_extension: str, data: Dict[str, Any], options: ExportOptions) -> List[_File]:
+    files = [_json_file(path_without_extension + ".json", orjson.dumps(data), options)]
+    if options.yaml:
+        files.append((path_without_extension + ".yaml", yaml.dump(data, Dumper=_YamlDumper)))
+    return files
+
+def _json_file(path: str, content: bytes, options: ExportOptions) -> _File:
+    if options.compress:
+        # The lowest compression level already shrinks the repetitive JSON a lot, and higher levels cost much more CPU time
+        return (path + ".gz", gzip.compress(content, compresslevel=1))
+    return (path, content)
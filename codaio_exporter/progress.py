@@ -1,8 +1,13 @@
-from typing import Generator, Optional, final, Final
+import time
+import asyncio
+from typing import Generator, Optional, Tuple, final, Final
 from rich.progress import Progress, TextColumn, BarColumn, MofNCompleteColumn, SpinnerColumn, TimeRemainingColumn, TaskProgressColumn
 from contextlib import contextmanager
 
 
+# rich only redraws the terminal ~10 times per second anyway, so there's no point in pushing updates more often than that
+_MIN_UPDATE_INTERVAL_SEC = 0.1
+
 @final
 class ProgressBar:
     def __init__(self, progress: Progress, name: str, total: Optional[int] = None):
@@ -10,6 +15,10 @@ class ProgressBar:
         self._total = total
         self._progress: Final = progress
         self._task_id: Final = self._progress.add_task(name, total=total)
+        self._last_update = 0.0
+        # Last (completed, total) state pushed to rich, so we can skip updates that wouldn't change anything
+        self._rendered: Optional[Tuple[int, Optional[int]]] = None
+        self._pending_flush: Optional[asyncio.TimerHandle] = None
         self._update()
     
     def set_total(self, total: int) -> None:
@@ -18,7 +27,7 @@ class ProgressBar:
     
     def increment_progress(self) -> None:
         self._current += 1
-        self._update()
+        self._update_throttled()
     
     def increment_total(self, update: bool = True) -> None:
         if self._total is None:
@@ -27,7 +36,33 @@ class ProgressBar:
         if update:
             self._update()
     
+    def _update_throttled(self) -> None:
+        # Always show the final state so that completion is visible
+        if self._current == self._total:
+            self._update()
+            return
+        elapsed = time.monotonic() - self._last_update
+        if elapsed >= _MIN_UPDATE_INTERVAL_SEC:
+            self._update()
+            return
+        # Make sure a skipped update still shows up once the interval is over, even if no further updates come in
+        if self._pending_flush is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._pending_flush = loop.call_later(_MIN_UPDATE_INTERVAL_SEC - elapsed, self._flush)
+
+    def _flush(self) -> None:
+        self._pending_flush = None
+        self._update()
+
     def _update(self) -> None:
+        state = (self._current, self._total)
+        if state == self._rendered:
+            return
+        self._rendered = state
+        self._last_update = time.monotonic()
         self._progress.update(self._task_id, completed=self._current, total=self._total)
 
 class ProgressDisplay:
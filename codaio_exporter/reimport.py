@@ -1,95 +1,111 @@
 import os
-from typing import Optional, Dict, final, Final
-from ensure import check  # type: ignore
-import aiofiles
+from typing import List, Optional, Dict, final, Final
 import asyncio
+import gzip
+import orjson
 
 from codaio_exporter.utils.generator import collect
+from codaio_exporter.utils.concurrencylimit import ConcurrencyLimit
 from codaio_exporter.api import make_api
 from codaio_exporter.api.doc import DocAPI
 from codaio_exporter.api.table import TableAPI, TableType
 from codaio_exporter.progress import ProgressDisplay
-from codaio_exporter.table import Table, Row
+from codaio_exporter.table import Table, Row, parse_table_from_dict
 from codaio_exporter.utils.gather import gather_cancel_on_first_error, gather_raise_first_error_after_all_tasks_complete
 
 
 @final
 class ProgressHandler:
     def __init__(self, num_tables: int, progress_display: Optional[ProgressDisplay]):
+        # Related steps share a progress bar, each of them advancing it once per table, so there are fewer bars for rich to render.
         self._progress_load_export = None
-        self._progress_load_table = None
-        self._progress_compatibility_check = None
-        self._progress_list_rows = None
-        self._progress_delete_rows_issued = None
-        self._progress_delete_rows_complete = None
-        self._progress_reimport_issued = None
-        self._progress_reimport_complete = None
+        self._progress_schema = None
+        self._progress_delete_rows = None
+        self._progress_reimport = None
         if progress_display is not None:
             self._progress_load_export = progress_display.add_task("Loading Tables from Export", total=num_tables)
-            self._progress_load_table = progress_display.add_task("Loading Tables from coda.io", total=num_tables)
-            self._progress_compatibility_check = progress_display.add_task("Comparing Schemas", total=num_tables)
-            self._progress_list_rows = progress_display.add_task("Listing Rows from coda.io", total=num_tables)
-            self._progress_delete_rows_issued = progress_display.add_task("Deleting Rows from coda.io (issued)", total=num_tables)
-            self._progress_delete_rows_complete = progress_display.add_task("Deleting Rows from coda.io (completed)", total=num_tables)
-            self._progress_reimport_issued = progress_display.add_task("Reimporting Rows from Export to coda.io (issued)", total=num_tables)
-            self._progress_reimport_complete = progress_display.add_task("Reimporting Rows from Export to coda.io (completed)", total=num_tables)
+            # Loading the table from coda.io, comparing its schema
+            self._progress_schema = progress_display.add_task("Loading Tables from coda.io and Comparing Schemas", total=2 * num_tables)
+            # Listing rows, issuing the deletion, completing the deletion
+            self._progress_delete_rows = progress_display.add_task("Deleting Rows from coda.io", total=3 * num_tables)
+            # Issuing the insertion, completing the insertion
+            self._progress_reimport = progress_display.add_task("Reimporting Rows from Export to coda.io", total=2 * num_tables)
 
     def increment_load_export(self) -> None:
         if self._progress_load_export is not None:
             self._progress_load_export.increment_progress()
 
     def increment_load_table(self) -> None:
-        if self._progress_load_table is not None:
-            self._progress_load_table.increment_progress()
+        self._increment_schema()
     
     def increment_compatibility_check(self) -> None:
-        if self._progress_compatibility_check is not None:
-            self._progress_compatibility_check.increment_progress()
+        self._increment_schema()
 
     def increment_list_rows(self) -> None:
-        if self._progress_list_rows is not None:
-            self._progress_list_rows.increment_progress()
+        self._increment_delete_rows()
 
     def increment_delete_rows_issued(self) -> None:
-        if self._progress_delete_rows_issued is not None:
-            self._progress_delete_rows_issued.increment_progress()
+        self._increment_delete_rows()
 
     def increment_delete_rows_complete(self) -> None:
-        if self._progress_delete_rows_complete is not None:
-            self._progress_delete_rows_complete.increment_progress()
+        self._increment_delete_rows()
     
     def increment_reimport_issued(self) -> None:
-        if self._progress_reimport_issued is not None:
-            self._progress_reimport_issued.increment_progress()
+        self._increment_reimport()
 
     def increment_reimport_complete(self) -> None:
-        if self._progress_reimport_complete is not None:
-            self._progress_reimport_complete.increment_progress()
+        self._increment_reimport()
 
+    def _increment_schema(self) -> None:
+        if self._progress_schema is not None:
+            self._progress_schema.increment_progress()
 
-async def reimport_doc(api_token: str, source_path: str, dest_doc_id: str, progress_display: Optional[ProgressDisplay] = None) -> None:
-    async with make_api(api_token) as api:
-        doc = await api.get_doc(dest_doc_id)
+    def _increment_delete_rows(self) -> None:
+        if self._progress_delete_rows is not None:
+            self._progress_delete_rows.increment_progress()
+
+    def _increment_reimport(self) -> None:
+        if self._progress_reimport is not None:
+            self._progress_reimport.increment_progress()
 
-        print("Reading tables from export...")
-        tables_path = os.path.join(source_path, "tables/table")
-        table_dirs = os.listdir(tables_path)
-        progress_handler = ProgressHandler(len(table_dirs), progress_display)
 
-        tables = await gather_cancel_on_first_error(*(_load_table(os.path.join(tables_path, table_dir, "table.json"), progress_handler) for table_dir in table_dirs))
-        print("Reading tables from export...done")
+async def reimport_doc(api_token: str, source_path: str, dest_doc_id: str, progress_display: Optional[ProgressDisplay] = None) -> None:
+    async with make_api(api_token) as api:
+        # Already look up the document on coda.io while the export is read from disk
+        doc_task = asyncio.create_task(api.get_doc(dest_doc_id))
+        try:
+            print("Reading tables from export...")
+            tables_path = os.path.join(source_path, "tables/table")
+            table_dirs = await asyncio.to_thread(_list_dir_paths, tables_path)
+            progress_handler = ProgressHandler(len(table_dirs), progress_display)
+
+            tables = await gather_cancel_on_first_error(*(_load_table(os.path.join(table_dir, "table.json"), progress_handler) for table_dir in table_dirs))
+            print("Reading tables from export...done")
+        except:
+            doc_task.cancel()
+            raise
+        doc = await doc_task
 
         print("Importing tables to coda.io...")
+        # Only start changing any table once all of them were checked to be compatible
         loaded_tables = await gather_cancel_on_first_error(*(_load_table_api_and_check_schema(doc, table, progress_handler) for table in tables))
         await gather_cancel_on_first_error(*(_reimport_table(table_api, table, progress_handler) for table, table_api in zip(tables, loaded_tables)))
         print("Importing tables to coda.io...done")
 
 async def _load_table(path: str, progress_handler: ProgressHandler) -> Table:
-    json = await _read_file(path)
-    result = Table.from_json(json)
+    result = await asyncio.to_thread(_load_table_sync, path)
     progress_handler.increment_load_export()
     return result
 
+# Read and parse in the same thread hop, so that parsing large tables doesn't block the event loop either
+def _load_table_sync(path: str) -> Table:
+    return parse_table_from_dict(orjson.loads(_read_json_file_sync(path)))
+
+# Work on a limited number of tables at a time, so that tables finish one after the other instead of all of them being in flight
+# and competing for the client's request and rate limits.
+_table_concurrency_limit = ConcurrencyLimit(32)
+
+@_table_concurrency_limit
 async def _load_table_api_and_check_schema(doc: DocAPI, table: Table, progress_handler: ProgressHandler) -> TableAPI:
     table_api = await doc.get_table(table.id)
     progress_handler.increment_load_table()
@@ -99,7 +115,7 @@ async def _load_table_api_and_check_schema(doc: DocAPI, table: Table, progress_h
 
 async def _check_table_is_compatible(table_api: TableAPI, table: Table) -> None:
     if table_api.name() != table.name:
-        raise Exception(f"Table {table.id}: Export states table name is {table.name} but server thinks it is {table_api.name}. Aborting this reimport just to be safe.")
+        raise Exception(f"Table {table.id}: Export states table name is {table.name} but server thinks it is {table_api.name()}. Aborting this reimport just to be safe.")
     if table_api.type() != TableType.table:
         raise Exception(f"Table {table.name} {table.id}: Server type is {table_api.type()} but expected it to be 'table'")
 
@@ -107,23 +123,26 @@ async def _check_table_is_compatible(table_api: TableAPI, table: Table) -> None:
 
 async def _check_columns_are_compatible(server_side_table: TableAPI, table: Table) -> None:
     columns_api = await collect(server_side_table.get_all_columns())
-    columns_api_by_id = {column.id(): column for column in columns_api}
+    get_server_column = {column.id(): column for column in columns_api}.get
     for column in table.columns:
-        if column.id not in columns_api_by_id:
+        server_column = get_server_column(column.id)
+        if server_column is None:
             raise Exception(f"Table {table.name} {table.id}: Column {column.name} {column.id} found in export but not on server")
-        server_column = columns_api_by_id[column.id]
         if column.name != server_column.name():
-            raise Exception(f"Table {table.name} {table.id}: Column {column.id}: Export states column name is {column.name} but server thinks it is {server_side_table.name}. Aborting this reimport just to be safe.")
-        if (not column.calculated) and server_column.calculated():
-            raise Exception(f"Table {table.name} {table.id}: Column {column.name} {column.id}: Export states column is a manual column but server states it is a calculated column")
-        if column.calculated and not server_column.calculated():
-            raise Exception(f"Table {table.name} {table.id}: Column {column.name} {column.id}: Export states column is a calculated column but server states it is a manual column")
+            raise Exception(f"Table {table.name} {table.id}: Column {column.id}: Export states column name is {column.name} but server thinks it is {server_column.name()}. Aborting this reimport just to be safe.")
+        if column.calculated != server_column.calculated():
+            raise Exception(f"Table {table.name} {table.id}: Column {column.name} {column.id}: Export states column is a {_column_kind(column.calculated)} column but server states it is a {_column_kind(server_column.calculated())} column")
 
+def _column_kind(calculated: bool) -> str:
+    return "calculated" if calculated else "manual"
 
+
+@_table_concurrency_limit
 async def _reimport_table(table_api: TableAPI, table: Table, progress_handler: ProgressHandler) -> None:
     await _delete_all_rows(table_api, progress_handler)
     await _insert_rows(table_api, table, progress_handler)
 
+# List the rows right before deleting them, so that rows added to the table in the meantime are deleted as well
 async def _delete_all_rows(table_api: TableAPI, progress_handler: ProgressHandler) -> None:
     rows = await collect(table_api.get_all_rows())
     row_ids = [row.id() for row in rows]
@@ -132,22 +151,34 @@ async def _delete_all_rows(table_api: TableAPI, progress_handler: ProgressHandle
     progress_handler.increment_delete_rows_complete()
     
 async def _insert_rows(table_api: TableAPI, table: Table, progress_handler: ProgressHandler) -> None:
+    num_columns = len(table.columns)
+    # Only columns without a formula can be written to. Look them up once instead of for every row.
+    writable_columns = [(index, column.id) for index, column in enumerate(table.columns) if column.formula is None]
     def format_row(row: Row) -> Dict[str, str]:
-        check(len(table.columns)).equals(len(row.cells)).or_raise(lambda _: Exception(f"Table {table.name} {table.id}: Export has {len(table.columns)} columns but a row in the export has {len(row.cells)} columns"))
-        result = {}
-        for i in range(len(row.cells)):
-            if table.columns[i].formula is None:
-                result[table.columns[i].id] = row.cells[i]
-        return result
+        cells = row.cells
+        if len(cells) != num_columns:
+            raise Exception(f"Table {table.name} {table.id}: Export has {num_columns} columns but a row in the export has {len(cells)} columns")
+        return {column_id: cells[index] for index, column_id in writable_columns}
     cells = [format_row(row) for row in table.rows]
     await table_api.insert_rows(cells, on_issued=progress_handler.increment_reimport_issued)
     progress_handler.increment_reimport_complete()
 
 
-# Semaphore to make sure we don't get 'too many open files'
-read_semaphore = asyncio.Semaphore(512)
-
-async def _read_file(path: str) -> str:
-    async with read_semaphore:
-        async with aiofiles.open(path, 'r') as file:
-            return await file.read()
+# Full paths of the directories in `path`. DirEntry already knows both its type and its path, so this doesn't need any extra syscalls or joins.
+def _list_dir_paths(path: str) -> List[str]:
+    with os.scandir(path) as entries:
+        return [entry.path for entry in entries if entry.is_dir()]
+
+# Called from worker threads. Each worker thread only has one file open at a time,
+# so the size of the thread pool already makes sure we don't get 'too many open files'.
+# Read as bytes, orjson can parse them without decoding them to a str first.
+def _read_file_sync(path: str) -> bytes:
+    with open(path, 'rb') as file:
+        return file.read()
+
+# Exports made with the `compress` option contain gzip compressed JSON files
+def _read_json_file_sync(path: str) -> bytes:
+    try:
+        return _read_file_sync(path)
+    except FileNotFoundError:
+        return gzip.decompress(_read_file_sync(path + ".gz"))
@@ -1,24 +1,27 @@
 from dataclasses import dataclass
-from dataclasses_json import DataClassJsonMixin
-from typing import List, Optional, final, Any, Dict
+from typing import List, Optional, Tuple, TextIO, final, Any, Dict
 from io import StringIO
 import html, csv
+from operator import attrgetter
 
 from codaio_exporter.api.column import ColumnAPI
-from codaio_exporter.api.row import RowAPI
+from codaio_exporter.api.parse import parse_str, parse_int, parse_bool, parse_dict_str_any
+from codaio_exporter.api.row import cell_values_in_order
 
 
+# There can be tens of thousands of rows in memory at once, so none of these get a __dict__
+
 @final
-@dataclass
-class Column(DataClassJsonMixin):
+@dataclass(slots=True)
+class Column:
     id: str
     name: str
     calculated: bool
     formula: Optional[str]
 
 @final
-@dataclass
-class Row(DataClassJsonMixin):
+@dataclass(slots=True)
+class Row:
     index: int
     id: str
     name: str
@@ -26,35 +29,76 @@ class Row(DataClassJsonMixin):
     raw_data: Dict[str, Any]
 
 @final
-@dataclass
-class Table(DataClassJsonMixin):
+@dataclass(slots=True)
+class Table:
     id: str
     name: str
     columns: List[Column]
     rows: List[Row]
 
+    # See parse_table_from_dict() for the inverse. The result shares the cells and raw data with this table instead of copying them.
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "columns": [
+                {"id": column.id, "name": column.name, "calculated": column.calculated, "formula": column.formula}
+                for column in self.columns
+            ],
+            "rows": [
+                {"index": row.index, "id": row.id, "name": row.name, "cells": row.cells, "raw_data": row.raw_data}
+                for row in self.rows
+            ],
+        }
+
     def to_csv(self) -> str:
         output = StringIO()
-        wr = csv.writer(output, quoting=csv.QUOTE_ALL)
-        wr.writerow([column.name for column in self.columns])
-        for row in self.rows:
-            wr.writerow(row.cells)
+        self.write_csv(output)
         return output.getvalue()
-    
+
     def to_html(self) -> str:
-        column_headers_html = "".join(_make_html_column_header(column) for column in self.columns)
-        rows = [
-            "".join([f"<td>{html.escape(str(cell))}</td>" for cell in row.cells]) for row in self.rows
-        ]
-        rows_html = "".join(f"<tr>{row}</tr>" for row in rows)
-        table_html =  f"<table><thead><tr>{column_headers_html}</tr></thead><tbody>{rows_html}</tbody></table>" 
-        return f"<html><head/><body>{table_html}</body></html>"
+        output = StringIO()
+        self.write_html(output)
+        return output.getvalue()
+
+    # The write_* functions stream the output into `output`, e.g. an open file, without building the whole document in memory
+    def write_csv(self, output: TextIO) -> None:
+        header = [column.name for column in self.columns]
+        if _can_write_csv_without_escaping(header, self.rows):
+            # With QUOTE_ALL, csv.writer only wraps each cell in quotes if there are no quotes to escape. Doing that ourselves is ~3x faster.
+            write = output.write
+            write('"' + '","'.join(header) + '"\r\n')
+            for row in self.rows:
+                write('"' + '","'.join(row.cells) + '"\r\n')
+        else:
+            wr = csv.writer(output, quoting=csv.QUOTE_ALL)
+            wr.writerow(header)
+            # Let the C implementation loop over the rows instead of calling writerow() for each of them
+            wr.writerows([row.cells for row in self.rows])
 
+    def write_html(self, output: TextIO) -> None:
+        write = output.write
+        escape = html.escape
+        write("<html><head/><body><table><thead><tr>")
+        for column in self.columns:
+            write(_make_html_column_header(column))
+        write("</tr></thead><tbody>")
+        for row in self.rows:
+            # One join and one write per row instead of three writes per cell
+            if row.cells:
+                write("<tr><td>" + "</td><td>".join(map(escape, row.cells)) + "</td></tr>")
+            else:
+                write("<tr></tr>")
+        write("</tbody></table></body></html>")
 
-def parse_table_from_api(table_id: str, table_name: str, columns: List[ColumnAPI], rows: List[RowAPI]) -> Table:
-    rows.sort(key=lambda row: row.index())
+
+# `rows` are the raw row dicts as returned by the API, see TableAPI.iter_raw_rows()
+def parse_table_from_api(table_id: str, table_name: str, columns: List[ColumnAPI], rows: List[Dict[str, Any]]) -> Table:
     parsed_columns = [_parse_column(column) for column in columns]
-    parsed_rows = [_parse_row(parsed_columns, row) for row in rows]
+    column_ids = tuple(column.id for column in parsed_columns)
+    parsed_rows = [_parse_row(column_ids, row) for row in rows]
+    # Sort after parsing so each row's index is only parsed once
+    parsed_rows.sort(key=attrgetter("index"))
     return Table(
         id=table_id,
         name=table_name,
@@ -62,6 +106,36 @@ def parse_table_from_api(table_id: str, table_name: str, columns: List[ColumnAPI
         rows=parsed_rows,
     )
 
+# Inverse of Table.to_dict(), e.g. for a table.json written by the export
+def parse_table_from_dict(data: Dict[str, Any]) -> Table:
+    return Table(
+        id=parse_str(data["id"]),
+        name=parse_str(data["name"]),
+        columns=[_parse_column_from_dict(column) for column in data["columns"]],
+        rows=[_parse_row_from_dict(row) for row in data["rows"]],
+    )
+
+def _parse_column_from_dict(data: Dict[str, Any]) -> Column:
+    formula = data["formula"]
+    return Column(
+        id=parse_str(data["id"]),
+        name=parse_str(data["name"]),
+        calculated=parse_bool(data["calculated"]),
+        formula=None if formula is None else parse_str(formula),
+    )
+
+def _parse_row_from_dict(data: Dict[str, Any]) -> Row:
+    cells = data["cells"]
+    if not isinstance(cells, list):
+        raise Exception(f"Tried to read {cells} as list")
+    return Row(
+        index=parse_int(data["index"]),
+        id=parse_str(data["id"]),
+        name=parse_str(data["name"]),
+        cells=cells,
+        raw_data=parse_dict_str_any(data["raw_data"]),
+    )
+
 def _parse_column(column: ColumnAPI) -> Column:
     return Column(
         id=column.id(),
@@ -70,18 +144,26 @@ def _parse_column(column: ColumnAPI) -> Column:
         formula=column.formula(),
     )
 
-def _parse_row(columns: List[Column], row: RowAPI) -> Row:
-    if row.num_cells() != len(columns):
-        raise Exception(f"_Row {row.id()} has wrong number of cells. Expected {len(columns)} columns but found {row.num_cells()}")
-    cells = [row.get_cell_value(column.id) for column in columns]
+def _parse_row(column_ids: Tuple[str, ...], row: Dict[str, Any]) -> Row:
+    row_id = parse_str(row["id"])
+    num_cells = len(row["values"])
+    if num_cells != len(column_ids):
+        raise Exception(f"_Row {row_id} has wrong number of cells. Expected {len(column_ids)} columns but found {num_cells}")
+    cells = cell_values_in_order(row, column_ids)
     return Row(
-        id=row.id(),
-        index=row.index(),
-        name=row.name(),
+        id=row_id,
+        index=parse_int(row["index"]),
+        name=parse_str(row["name"]),
         cells=cells,
-        raw_data=row.raw_data(),
+        raw_data=row,
     )
 
+# csv.writer writes empty rows without any quotes and doubles quotes inside of cells, so only bypass it if neither happens
+def _can_write_csv_without_escaping(header: List[str], rows: List[Row]) -> bool:
+    if not header or any('"' in name for name in header):
+        return False
+    return all(row.cells and not any('"' in cell for cell in row.cells) for row in rows)
+
 def _make_html_column_header(column: Column) -> str:
     formula = column.formula
     if formula is None:
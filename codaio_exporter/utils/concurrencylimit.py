@@ -1,4 +1,4 @@
-from typing import Callable, Awaitable, TypeVar, ParamSpec, final, Final
+from typing import Any, Callable, Awaitable, Coroutine, TypeVar, ParamSpec, final, Final
 from asyncio import Semaphore
 from functools import wraps
 
@@ -12,7 +12,7 @@ class ConcurrencyLimit:
     def __init__(self, max_num_tasks: int):
         self._semaphore: Final = Semaphore(max_num_tasks)
 
-    def __call__(self, func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+    def __call__(self, func: Callable[P, Awaitable[R]]) -> Callable[P, Coroutine[Any, Any, R]]:
         @wraps(func)
         async def inner(*args: P.args, **kwds: P.kwargs) -> R:
             async with self._semaphore:
@@ -1,28 +1,40 @@
 import asyncio
 import logging
-from typing import List, TypeVar, Coroutine, Any
+from typing import List, Optional, TypeVar, Coroutine, Any, cast
 
 T = TypeVar('T')
 
 # Like asyncio.gather(), but if one of the tasks fails, all others are cancelled instead of continuing to execute.
+# The error is only raised once the cancelled tasks actually stopped, so none of them keeps running in the background.
 async def gather_cancel_on_first_error(*coroutines: Coroutine[Any, Any, T]) -> List[T]:
+    futures: List[asyncio.Task[T]] = []
     try:
-        futures = [asyncio.create_task(c) for c in coroutines]
+        for c in coroutines:
+            futures.append(asyncio.create_task(c))
         return await asyncio.gather(*futures)
     except:
         for future in futures:
             future.cancel()
+        await asyncio.gather(*futures, return_exceptions=True)
         raise
 
 # Like asyncio.gather(), but if one of the tasks failed, first all other tasks are completed,
 # then we log all errors and raise the first error.
 async def gather_raise_first_error_after_all_tasks_complete(*coroutines: Coroutine[Any, Any, T]) -> List[T]:
-    futures = [asyncio.create_task(c) for c in coroutines]
-    results = await asyncio.gather(*futures, return_exceptions=True)
-    errors = [result for result in results if isinstance(result, Exception)]
-    for error in errors:
-        logging.error(error)
-    if len(errors) > 0:
-        raise errors[0]
-    
-    return results
+    return await wait_raise_first_error_after_all_tasks_complete([asyncio.create_task(c) for c in coroutines])
+
+# Like gather_raise_first_error_after_all_tasks_complete(), but for tasks that are already running
+async def wait_raise_first_error_after_all_tasks_complete(tasks: List['asyncio.Task[T]']) -> List[T]:
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    # BaseException and not just Exception, so that e.g. a cancelled task isn't mistaken for a successful result
+    first_error: Optional[BaseException] = None
+    for result in results:
+        if isinstance(result, BaseException):
+            logging.error(result)
+            if first_error is None:
+                first_error = result
+    if first_error is not None:
+        raise first_error
+
+    # No result is an exception anymore, otherwise we would have raised above
+    return cast(List[T], results)
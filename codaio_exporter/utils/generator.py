@@ -1,5 +1,7 @@
 import asyncio
-from typing import AsyncGenerator, List, TypeVar, Callable, Coroutine, Any, Optional
+from typing import AsyncGenerator, Dict, List, TypeVar, Callable, Coroutine, Any, Optional
+
+from codaio_exporter.utils.gather import wait_raise_first_error_after_all_tasks_complete
 
 T = TypeVar('T')
 
@@ -13,9 +15,46 @@ async def collect(generator: AsyncGenerator[T, None], per_item_callback: Optiona
     return result
 
 # `async for` isn't concurrent and does one iteration strictly after the other. This function allows us
-# to process multiple loop iterations concurrently.
-async def concurrent_async_for(generator: AsyncGenerator[T, None], loop_body: Callable[[T], Coroutine[Any, Any, None]]) -> None:
-    tasks = []
-    async for item in generator:
-        tasks.append(asyncio.create_task(loop_body(item)))
-    await asyncio.gather(*tasks)
+# to process multiple loop iterations concurrently. Each loop body starts as soon as its item was generated.
+# Like gather_raise_first_error_after_all_tasks_complete(), if a loop body fails, the other ones are still completed before the first error is raised.
+# No further items are taken from the generator after a loop body failed though, since we're going to raise anyway.
+# If `max_concurrency` is set, at most that many loop bodies run at the same time. Further items are only taken from the generator
+# once a loop body finished, so items aren't pulled from the generator and turned into tasks faster than they can run.
+async def concurrent_async_for(generator: AsyncGenerator[T, None], loop_body: Callable[[T], Coroutine[Any, Any, None]], max_concurrency: Optional[int] = None) -> None:
+    semaphore = None if max_concurrency is None else asyncio.Semaphore(max_concurrency)
+    # Loop bodies that are still running or that failed. Successful ones are removed as soon as they finish,
+    # so they don't pile up for long generators. It's a dict instead of a set to keep the errors in the order of the items.
+    tasks: Dict[asyncio.Task[None], None] = {}
+    failed = False
+
+    def on_done(task: asyncio.Task[None]) -> None:
+        nonlocal failed
+        if semaphore is not None:
+            semaphore.release()
+        # A cancelled task didn't finish its work either, so it counts as failed and its CancelledError gets raised
+        if not task.cancelled() and task.exception() is None:
+            del tasks[task]
+        else:
+            failed = True
+
+    try:
+        try:
+            async for item in generator:
+                if semaphore is not None:
+                    await semaphore.acquire()
+                if failed:
+                    break
+                task = asyncio.create_task(loop_body(item))
+                tasks[task] = None
+                task.add_done_callback(on_done)
+        finally:
+            # After a `break`, close the generator now instead of whenever it gets garbage collected,
+            # so that it stops its work (e.g. prefetching the next page) before we wait for the remaining loop bodies.
+            await generator.aclose()
+    except:
+        # Don't leave the already started loop bodies running in the background
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    await wait_raise_first_error_after_all_tasks_complete(list(tasks))
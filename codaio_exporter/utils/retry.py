@@ -18,7 +18,8 @@ def retry(max_num_retries: int) -> Callable[[Callable[P, Awaitable[R]]], Callabl
             while True:
                 try:
                     return await func(*args, **kwds)
-                except:
+                # Not a bare except, so that asyncio.CancelledError (a BaseException) stops the retries instead of being retried
+                except Exception:
                     remaining_retries -= 1
                     if remaining_retries < 0:
                         raise
@@ -0,0 +1,65 @@
+import asyncio
+from typing import List
+
+from codaio_exporter.utils.gather import gather_cancel_on_first_error, gather_raise_first_error_after_all_tasks_complete
+
+
+async def _return_after(value: int, delay_sec: float) -> int:
+    await asyncio.sleep(delay_sec)
+    return value
+
+async def _raise_after(delay_sec: float) -> int:
+    await asyncio.sleep(delay_sec)
+    raise ValueError("failed")
+
+
+def test_gather_cancel_on_first_error_returns_results_in_order() -> None:
+    assert asyncio.run(gather_cancel_on_first_error(_return_after(1, 0.02), _return_after(2, 0.01))) == [1, 2]
+
+
+def test_gather_cancel_on_first_error_cancels_other_tasks() -> None:
+    cancelled: List[int] = []
+
+    async def wait_for_cancellation(value: int) -> int:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(value)
+            raise
+        return value
+
+    async def run() -> None:
+        try:
+            await gather_cancel_on_first_error(wait_for_cancellation(1), _raise_after(0.01), wait_for_cancellation(2))
+        except ValueError:
+            pass
+        else:
+            assert False, "Expected ValueError"
+        # The other tasks already stopped by the time the error is raised
+        assert sorted(cancelled) == [1, 2]
+
+    asyncio.run(run())
+
+
+def test_gather_raise_first_error_after_all_tasks_complete_waits_for_other_tasks() -> None:
+    finished: List[int] = []
+
+    async def finish_after(value: int, delay_sec: float) -> int:
+        await asyncio.sleep(delay_sec)
+        finished.append(value)
+        return value
+
+    async def run() -> None:
+        try:
+            await gather_raise_first_error_after_all_tasks_complete(finish_after(1, 0.02), _raise_after(0.01), finish_after(2, 0.03))
+        except ValueError:
+            pass
+        else:
+            assert False, "Expected ValueError"
+
+    asyncio.run(run())
+    assert finished == [1, 2]
+
+
+def test_gather_raise_first_error_after_all_tasks_complete_returns_results_in_order() -> None:
+    assert asyncio.run(gather_raise_first_error_after_all_tasks_complete(_return_after(1, 0.02), _return_after(2, 0.01))) == [1, 2]
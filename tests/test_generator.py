@@ -0,0 +1,182 @@
+import asyncio
+from typing import AsyncGenerator, List
+
+from codaio_exporter.utils.generator import collect, concurrent_async_for
+
+
+async def _generate(num_items: int) -> AsyncGenerator[int, None]:
+    for i in range(num_items):
+        yield i
+
+
+def test_collect() -> None:
+    assert asyncio.run(collect(_generate(3))) == [0, 1, 2]
+
+
+def test_concurrent_async_for_runs_all_loop_bodies_concurrently() -> None:
+    started: List[int] = []
+    finished: List[int] = []
+
+    async def run() -> None:
+        all_started = asyncio.Event()
+        async def loop_body(item: int) -> None:
+            started.append(item)
+            if len(started) == 5:
+                all_started.set()
+            # Only finishes if all loop bodies run at the same time
+            await asyncio.wait_for(all_started.wait(), timeout=1)
+            finished.append(item)
+        await concurrent_async_for(_generate(5), loop_body)
+
+    asyncio.run(run())
+    assert sorted(finished) == [0, 1, 2, 3, 4]
+
+
+def test_concurrent_async_for_completes_other_loop_bodies_before_raising() -> None:
+    finished: List[int] = []
+
+    async def loop_body(item: int) -> None:
+        if item == 0:
+            raise ValueError("loop body failed")
+        await asyncio.sleep(0.01)
+        finished.append(item)
+
+    async def run() -> None:
+        try:
+            await concurrent_async_for(_generate(3), loop_body)
+        except ValueError as e:
+            assert str(e) == "loop body failed"
+        else:
+            assert False, "Expected ValueError"
+
+    asyncio.run(run())
+    # Loop bodies that were already started when the error happened still ran to completion
+    assert finished == [1, 2]
+
+
+def test_concurrent_async_for_stops_generating_after_a_loop_body_failed() -> None:
+    generated: List[int] = []
+
+    async def generate() -> AsyncGenerator[int, None]:
+        for i in range(100):
+            generated.append(i)
+            yield i
+            # Give the loop bodies a chance to run
+            await asyncio.sleep(0)
+
+    async def loop_body(item: int) -> None:
+        raise ValueError()
+
+    async def run() -> None:
+        try:
+            await concurrent_async_for(generate(), loop_body)
+        except ValueError:
+            pass
+        else:
+            assert False, "Expected ValueError"
+
+    asyncio.run(run())
+    assert len(generated) < 100
+
+
+def test_concurrent_async_for_raises_if_a_loop_body_was_cancelled() -> None:
+    async def loop_body(item: int) -> None:
+        if item == 1:
+            raise asyncio.CancelledError()
+
+    async def run() -> None:
+        try:
+            await concurrent_async_for(_generate(3), loop_body)
+        except asyncio.CancelledError:
+            pass
+        else:
+            assert False, "Expected CancelledError"
+
+    asyncio.run(run())
+
+
+def test_concurrent_async_for_cancels_loop_bodies_if_generator_fails() -> None:
+    cancelled: List[int] = []
+
+    async def generate() -> AsyncGenerator[int, None]:
+        yield 0
+        yield 1
+        await asyncio.sleep(0.01)
+        raise ValueError("generator failed")
+
+    async def loop_body(item: int) -> None:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(item)
+            raise
+
+    async def run() -> None:
+        try:
+            await concurrent_async_for(generate(), loop_body)
+        except ValueError as e:
+            assert str(e) == "generator failed"
+        else:
+            assert False, "Expected ValueError"
+
+    asyncio.run(run())
+    assert sorted(cancelled) == [0, 1]
+
+
+def test_concurrent_async_for_closes_generator_after_a_loop_body_failed() -> None:
+    events: List[str] = []
+
+    async def generate() -> AsyncGenerator[int, None]:
+        try:
+            for i in range(100):
+                yield i
+                await asyncio.sleep(0.01)
+        finally:
+            events.append("generator closed")
+
+    async def loop_body(item: int) -> None:
+        if item == 1:
+            raise ValueError()
+        await asyncio.sleep(0.1)
+        events.append("loop body finished")
+
+    async def run() -> None:
+        try:
+            await concurrent_async_for(generate(), loop_body)
+        except ValueError:
+            pass
+        else:
+            assert False, "Expected ValueError"
+        events.append("raised")
+
+    asyncio.run(run())
+    # The generator is closed right away and not only once the remaining loop bodies finished
+    assert events == ["generator closed", "loop body finished", "raised"]
+
+
+def test_concurrent_async_for_limits_concurrency_and_generation() -> None:
+    generated = 0
+    running = 0
+    max_running = 0
+    max_generated_ahead = 0
+
+    async def generate() -> AsyncGenerator[int, None]:
+        nonlocal generated
+        for i in range(10):
+            generated += 1
+            yield i
+
+    async def loop_body(item: int) -> None:
+        nonlocal running, max_running, max_generated_ahead
+        running += 1
+        max_running = max(max_running, running)
+        # Items are only taken from the generator once there's a free slot for them
+        max_generated_ahead = max(max_generated_ahead, generated - item)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    asyncio.run(concurrent_async_for(generate(), loop_body, max_concurrency=3))
+    assert generated == 10
+    assert max_running == 3
+    # The running loop bodies plus the one item that is waiting for a free slot
+    assert max_generated_ahead <= 4
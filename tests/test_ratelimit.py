@@ -0,0 +1,87 @@
+import asyncio
+import time
+from typing import List
+
+from codaio_exporter.utils.ratelimit import TokenBucketRateLimit
+
+
+class _TooManyRequests(Exception):
+    pass
+
+
+def test_burst_is_not_delayed() -> None:
+    limit = TokenBucketRateLimit(_TooManyRequests, max_requests_per_sec=1, burst=5, backoff_interval_sec=10)
+
+    @limit
+    async def call() -> None:
+        pass
+
+    async def run() -> float:
+        start = time.monotonic()
+        await asyncio.gather(*(call() for _ in range(5)))
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) < 0.5
+
+
+def test_calls_after_burst_are_limited_to_rate() -> None:
+    limit = TokenBucketRateLimit(_TooManyRequests, max_requests_per_sec=50, burst=5, backoff_interval_sec=10)
+    call_times: List[float] = []
+
+    @limit
+    async def call() -> None:
+        call_times.append(time.monotonic())
+
+    async def run() -> float:
+        start = time.monotonic()
+        await asyncio.gather(*(call() for _ in range(15)))
+        return start
+
+    start = asyncio.run(run())
+    assert len(call_times) == 15
+    # The first 5 calls use the burst, the other 10 have to wait for a token each at 50 tokens/sec
+    assert max(call_times[:5]) - start < 0.1
+    assert max(call_times) - start >= 0.15
+
+
+def test_backoff_exception_blocks_and_retries() -> None:
+    limit = TokenBucketRateLimit(_TooManyRequests, max_requests_per_sec=100, burst=5, backoff_interval_sec=0.2)
+    num_calls = 0
+
+    @limit
+    async def call() -> str:
+        nonlocal num_calls
+        num_calls += 1
+        if num_calls == 1:
+            raise _TooManyRequests()
+        return "result"
+
+    async def run() -> float:
+        start = time.monotonic()
+        assert await call() == "result"
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) >= 0.2
+    assert num_calls == 2
+
+
+def test_other_exceptions_are_not_retried() -> None:
+    limit = TokenBucketRateLimit(_TooManyRequests, max_requests_per_sec=100, burst=5, backoff_interval_sec=10)
+    num_calls = 0
+
+    @limit
+    async def call() -> None:
+        nonlocal num_calls
+        num_calls += 1
+        raise ValueError()
+
+    async def run() -> None:
+        try:
+            await call()
+        except ValueError:
+            pass
+        else:
+            assert False, "Expected ValueError"
+
+    asyncio.run(run())
+    assert num_calls == 1
@@ -0,0 +1,51 @@
+import csv
+from io import StringIO
+from typing import List
+
+from codaio_exporter.table import Table, Column, Row, parse_table_from_dict, _can_write_csv_without_escaping
+
+
+def _make_table(cells: List[List[str]]) -> Table:
+    return Table(
+        id="grid-1",
+        name="My Table",
+        columns=[
+            Column(id="c-1", name="Name", calculated=False, formula=None),
+            Column(id="c-2", name="Sum", calculated=True, formula="thisRow.A + thisRow.B"),
+        ],
+        rows=[
+            Row(index=index, id=f"i-{index}", name=f"Row {index}", cells=row_cells, raw_data={"id": f"i-{index}", "values": {}})
+            for index, row_cells in enumerate(cells)
+        ],
+    )
+
+# What the csv module writes for the table, i.e. what write_csv has to be equivalent to
+def _csv_writer_output(table: Table) -> str:
+    output = StringIO()
+    wr = csv.writer(output, quoting=csv.QUOTE_ALL)
+    wr.writerow([column.name for column in table.columns])
+    wr.writerows([row.cells for row in table.rows])
+    return output.getvalue()
+
+
+def test_parse_table_from_dict_is_inverse_of_to_dict() -> None:
+    table = _make_table([["a", "1"], ["b", "2"]])
+    assert parse_table_from_dict(table.to_dict()) == table
+
+
+def test_csv_fast_path_matches_csv_writer() -> None:
+    table = _make_table([["a", "1"], ["b,c", "line\nbreak"], ["", ""]])
+    assert _can_write_csv_without_escaping([column.name for column in table.columns], table.rows)
+    assert table.to_csv() == _csv_writer_output(table)
+
+
+def test_csv_with_quotes_matches_csv_writer() -> None:
+    table = _make_table([["a", "1"], ['say "hi"', "2"]])
+    assert not _can_write_csv_without_escaping([column.name for column in table.columns], table.rows)
+    assert table.to_csv() == _csv_writer_output(table)
+
+
+def test_csv_with_empty_row_matches_csv_writer() -> None:
+    table = _make_table([["a", "1"], []])
+    assert not _can_write_csv_without_escaping([column.name for column in table.columns], table.rows)
+    assert table.to_csv() == _csv_writer_output(table)